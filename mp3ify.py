@@ -1,6 +1,7 @@
 import os
-from multiprocessing import Pool, Manager
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from typing import Tuple
 from dotenv import load_dotenv
 
@@ -10,6 +11,49 @@ import yt_dlp as youtube_dl # Easy to switch to yt_dlp if youtube_dl is not work
 
 import utils
 
+_SEARCH_OPTS = {
+    'format': 'bestaudio/best',
+    'noplaylist': True,
+    'quiet': True,
+    'no_warnings': True,
+    'extract_flat': 'in_playlist',  # Only the search result summaries are needed, not the video pages
+    'skip_download': True
+}
+
+_DOWNLOAD_OPTS = {
+    'format': 'bestaudio[ext=m4a]/bestaudio/best',
+    'noplaylist': True,
+    'quiet': True,
+    'no_warnings': True,
+    # Segmented multi-connection downloads; yt-dlp falls back to its own downloader if aria2c is not installed
+    'external_downloader': {'default': 'aria2c'},
+    'external_downloader_args': {'aria2c': ['-x', '16', '-s', '16', '-k', '1M', '--file-allocation=none']}
+}
+
+
+def get_liked_songs(sp: Spotify, page_size: int = 50, max_workers: int = 8) -> dict:
+    """
+    Retrieves all liked songs of the current user. The first page reports the total number of liked songs,
+    the remaining pages are then fetched concurrently.
+
+    Args:
+        sp (Spotify): An authenticated Spotify client.
+        page_size (int, optional): The number of tracks per request. Defaults to 50, the maximum allowed by Spotify.
+        max_workers (int, optional): The maximum number of pages fetched at the same time. Defaults to 8.
+
+    Returns:
+        dict: The first page of liked songs with the items of all pages in 'items'.
+    """
+    liked_songs = sp.current_user_saved_tracks(limit=page_size)
+    offsets = range(page_size, liked_songs['total'], page_size)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pages = executor.map(lambda offset: sp.current_user_saved_tracks(limit=page_size, offset=offset), offsets)
+        for page in pages:
+            liked_songs['items'].extend(page['items'])
+
+    return liked_songs
+
 
 def get_info_single_track(item: dict) -> dict:
     """
@@ -25,18 +69,23 @@ def get_info_single_track(item: dict) -> dict:
             - 'duration_ms': A float representing the duration of the song in seconds.
             - 'search_query': A string representing a search query for the song.
             - 'full_title': A string representing the full title of the song in the format 'artist1, artist2 - song_name'.
+            - 'song_name_normalized': The song name normalized for matching search results.
+            - 'artists_normalized': The artist names normalized for matching search results.
     """
     track = item['track']
     artists, song_name = utils.process_spotify_song_name([artist['name'] for artist in track['artists']], track['name'])
     duration_ms = track['duration_ms']
+    joined_artists = ", ".join(artists)
     search_query = f'{" ".join(artists)} - {song_name} autogenerated'
-    full_title = f'{", ".join(artists)} - {song_name}'
+    full_title = f'{joined_artists} - {song_name}'
 
     return {'artists': artists,
             'song_name': song_name, 
             'duration_ms': duration_ms / 1000,
             'search_query': search_query,
-            'full_title': full_title
+            'full_title': full_title,
+            'song_name_normalized': utils.normalize(song_name),
+            'artists_normalized': utils.normalize(joined_artists)
             }
 
 
@@ -50,18 +99,74 @@ def get_info_tracks(liked_songs: dict) -> list:
     Returns:
         list: A list of track information.
     """
-    tracks = []
-    for track in liked_songs['items']:
-        info = get_info_single_track(track)
-        tracks.append(info)
-    return tracks
+    return [get_info_single_track(track) for track in liked_songs['items']]
+
+
+_search_local = threading.local()  # YoutubeDL is not thread-safe, so every search thread gets its own instance
+
+
+def get_search_ydl() -> youtube_dl.YoutubeDL:
+    """
+    Returns the YoutubeDL instance used for YouTube searches by the current thread, creating it on first use.
+    The instance lives as long as the thread so that consecutive searches reuse its HTTP connections.
+
+    Returns:
+        YoutubeDL: The YoutubeDL instance of the current thread.
+    """
+    if getattr(_search_local, 'ydl', None) is None:
+        _search_local.ydl = youtube_dl.YoutubeDL(dict(_SEARCH_OPTS))  # YoutubeDL updates its params in place
+    return _search_local.ydl
+
+
+def search_youtube(query: str, max_results: int) -> list:
+    """
+    Searches YouTube for the given query, serving repeated searches from the on-disk cache.
+
+    Args:
+        query (str): The search query.
+        max_results (int): The maximum number of search results to return.
+
+    Returns:
+        list: A list of flat search results. Besides the 'title', 'channel', 'duration' and 'webpage_url' used for matching,
+            each result keeps the fields yt-dlp needs to resolve it again ('_type', 'ie_key', 'id' and 'url').
+    """
+    search = f'ytsearch{max_results}:{query}'
+    entries = utils.load_cached_search(search)
+    if entries is not None and all('channel' in entry for entry in entries):  # Older entries lack the channel needed for "Topic" uploads
+        return entries
+
+    search_results = get_search_ydl().extract_info(search, download=False)
+    entries = [{'_type': 'url',
+                'ie_key': entry.get('ie_key'),
+                'id': entry.get('id'),
+                'url': entry['url'],
+                'title': entry.get('title'),
+                'channel': entry.get('channel') or entry.get('uploader'),
+                'duration': entry.get('duration'),
+                'webpage_url': entry.get('webpage_url') or entry['url']
+                } for entry in search_results['entries']]
+    if entries:
+        utils.store_cached_search(search, entries)
+    return entries
+
+
+def forget_youtube_search(query: str, max_results: int = 5) -> None:
+    """
+    Drops the cached results of a YouTube search, so that the next run searches YouTube again.
+    Used for tracks that failed, as a video may have been removed or better results may have appeared.
+
+    Args:
+        query (str): The search query.
+        max_results (int, optional): The maximum number of search results the search was made with. Defaults to 5.
+    """
+    utils.remove_cached_search(f'ytsearch{max_results}:{query}')
 
 
 def search_single_track(result, track_info, 
                         duration_tolerance, 
                         title_similarity_threshold, 
                         artist_similarity_threshold
-                        ) -> Tuple[str, float, float]:
+                        ) -> Tuple[dict, float, float]:
     """
     Searches for a single track based on the given result and track_info.
 
@@ -73,8 +178,11 @@ def search_single_track(result, track_info,
         artist_similarity_threshold (float): The minimum required similarity ratio between the result's artist and track_info's artists.
 
     Returns:
-        tuple: A tuple containing the URL of the track, the similarity ratio of the title and the similarity ratio of the artist
+        tuple: A tuple containing the result if it matches the track (otherwise None), the similarity ratio of the title and the similarity ratio of the artist
     """
+    if result.get('duration') is None or not result.get('title'):  # Flat results of live streams have no duration, some have no title
+        return None, 0, 0
+
     duration_diff = abs(result['duration'] - track_info['duration_ms'])
 
     if duration_diff > duration_tolerance:
@@ -82,18 +190,24 @@ def search_single_track(result, track_info,
 
     artist = result.get('artist', None)
     if artist is None:
-        artist, title = utils.process_yt_title(result['title'])
+        artist, title = utils.process_yt_title(result['title'], result.get('channel'))
     else: 
         title = result['title']
     
-    title_similarity = utils.similarity_ratio(title, track_info['song_name'])
-    artist_similarity = utils.similarity_ratio(", ".join(artist), ", ".join(track_info['artists']))
+    title_similarity = utils.similarity_ratio(utils.normalize(title), track_info['song_name_normalized'], normalized=True,
+                                              score_cutoff=title_similarity_threshold)
+    if title_similarity < title_similarity_threshold:
+        return None, title_similarity, 0
 
-    if title_similarity < title_similarity_threshold or artist_similarity < artist_similarity_threshold:
+    if duration_diff < 2:  # A matching title at the exact duration is the official or autogenerated upload
+        return result, title_similarity, 1.0
+
+    artist_similarity = utils.similarity_ratio(utils.normalize(", ".join(artist)), track_info['artists_normalized'], normalized=True,
+                                               score_cutoff=artist_similarity_threshold)
+    if artist_similarity < artist_similarity_threshold:
         return None, title_similarity, artist_similarity
 
-    url = result['webpage_url']
-    return url, title_similarity, artist_similarity
+    return result, title_similarity, artist_similarity
 
 
 def search_youtube_single_track(track_info: dict,
@@ -101,7 +215,7 @@ def search_youtube_single_track(track_info: dict,
                                 duration_tolerance: int = 10,
                                 title_similarity_threshold: float = 0.7,
                                 artist_similarity_threshold: float = 0.05
-                                ) -> Tuple[str, str]:
+                                ) -> Tuple[dict, str]:
     """
     Search for a single track on YouTube based on the provided track information.
 
@@ -110,8 +224,9 @@ def search_youtube_single_track(track_info: dict,
             It should have the following keys:
             - 'search_query' (str): The search query for the track.
             - 'duration_ms' (int): The duration of the track in milliseconds.
-            - 'song_name' (str): The name of the song.
-            - 'artists' (list): A list of artists associated with the track.
+            - 'song_name_normalized' (str): The normalized name of the song.
+            - 'artists_normalized' (str): The normalized artists associated with the track.
+            - 'full_title' (str): The full title of the track.
 
         max_results (int, optional): The maximum number of search results to consider. Defaults to 5.
         duration_tolerance (int, optional): The tolerance for the difference in duration between the track and the search results. Defaults to 10.
@@ -119,79 +234,147 @@ def search_youtube_single_track(track_info: dict,
         artist_similarity_threshold (float, optional): The threshold for the similarity ratio between the track artist and the search results. Defaults to 0.4.
 
     Returns:
-        tuple: A tuple containing the YouTube URL of the best match and the full title of the track.
+        tuple: A tuple containing the search result of the best match and the full title of the track.
 
     Raises:
         RuntimeError: If there is an error searching YouTube.
     """
-    ydl_opts = {
-        'format': 'bestaudio/best',
-        'noplaylist': True,
-        'quiet': True,
-        'no_warnings': True
-    }
-
-    with youtube_dl.YoutubeDL(ydl_opts) as ydl:
-        try:
-            search_results = ydl.extract_info(f'ytsearch{max_results}:{track_info["search_query"]}', download=False)
-        except Exception as e:
-            raise RuntimeError(f"Error searching YouTube: {e}")
-
-        matches = []
-        with ThreadPoolExecutor() as executor:
-            futures = [executor.submit(search_single_track, result, track_info, duration_tolerance, title_similarity_threshold, artist_similarity_threshold) for result in search_results['entries']]
-            for future in as_completed(futures):
-                match = future.result()
-                if match[0]:
-                    matches.append(match)
-
-        full_title = track_info['full_title']
-        if not matches:
-            return None, full_title
-
-        yt_url, _, _ = max(matches, key=lambda x: x[1] + x[2])
-        print(f"Found: {full_title} at {yt_url}")
-        return yt_url, full_title
+    try:
+        search_results = search_youtube(track_info['search_query'], max_results)
+    except Exception as e:
+        raise RuntimeError(f"Error searching YouTube: {e}")
+
+    best_match, best_score = None, None
+    for result in search_results:
+        match, title_similarity, artist_similarity = search_single_track(result, track_info, duration_tolerance, title_similarity_threshold, artist_similarity_threshold)
+        if not match:
+            continue
+
+        # Word set ratios often saturate at 1.0, so equal scores are decided by the closer duration
+        score = (title_similarity + artist_similarity, -abs(match['duration'] - track_info['duration_ms']))
+        if best_score is None or score > best_score:
+            best_match, best_score = match, score
+
+    full_title = track_info['full_title']
+    if best_match is None:
+        return None, full_title
+
+    print(f"Found: {full_title} at {best_match['webpage_url']}")
+    return best_match, full_title
     
 
-def download_track(track: dict, failed_tracks: list) -> None:
+def download_track(entry: dict, title: str) -> str:
     """
-    Downloads a track from YouTube using the provided track information.
+    Downloads the audio of a track from YouTube as is, without re-encoding it.
 
     Args:
-        track (dict): A dictionary containing information about the track.
-        failed_tracks (list): A concurrent list to store the titles of tracks that failed to download.
+        entry (dict): The YouTube search result of the track.
+        title (str): The full title of the track, used as the file name.
     
     Returns:
-        None
+        str: The path of the downloaded audio file, or None if the download failed.
     """
-    url, title = search_youtube_single_track(track)
-    
-    if url is None:
-        failed_tracks.append(title)
-        return
-    
-    ydl_opts = {
-        'format': 'bestaudio/best',
-        'noplaylist': True,
-        'quiet': True,
-        'no_warnings': True,
-        'postprocessors': [{
-            'key': 'FFmpegExtractAudio',
-            'preferredcodec': 'mp3',
-            'preferredquality': '320'
-        }],
-        'outtmpl': os.path.join(utils.format_download_dir(), 
-                                title.replace(":", "")  # Windows does not allow certain characters in filenames
-                                     .replace("&", "and"))
-    }
+    ydl_opts = {**_DOWNLOAD_OPTS,
+                'outtmpl': os.path.join(utils.format_download_dir(), 
+                                        title.replace(":", "")  # Windows does not allow certain characters in filenames
+                                             .replace("&", "and") + '.%(ext)s')
+                }
 
     with youtube_dl.YoutubeDL(ydl_opts) as ydl:
         try:
-            ydl.download([url])
+            info = ydl.process_ie_result(entry, download=True)
+            return info['requested_downloads'][0]['filepath']
         except Exception as e:
             print(f"Error downloading {title}: {e}")
-            failed_tracks.append(title)
+            return None
+
+
+def encode_to_mp3(path: str) -> bool:
+    """
+    Encodes a downloaded audio file to a LAME V0 (highest quality VBR) MP3 next to it using FFmpeg and removes the original file.
+
+    Args:
+        path (str): The path of the downloaded audio file.
+
+    Returns:
+        bool: True if the file was encoded successfully, otherwise False.
+    """
+    mp3_path = os.path.splitext(path)[0] + '.mp3'
+    try:
+        subprocess.run(['ffmpeg', '-y', '-loglevel', 'error', '-i', path,
+                        '-vn', '-codec:a', 'libmp3lame', '-q:a', '0', mp3_path],
+                       check=True)
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"Error encoding {path}: {e}")
+        return False
+
+    try:
+        os.remove(path)
+    except OSError as e:  # The MP3 is complete, so only report the leftover file
+        print(f"Could not remove {path}: {e}")
+
+    return True
+
+
+def download_tracks(tracks: list,
+                    search_workers: int = 16,
+                    download_workers: int = 4,
+                    encode_workers: int = os.cpu_count()
+                    ) -> list:
+    """
+    Searches, downloads and encodes the given tracks as a pipeline. Tracks are searched concurrently, every
+    match is handed to the download workers as soon as its search completes and every downloaded file is
+    handed to the encode workers, so network transfers and MP3 encoding do not hold up each other.
+
+    Args:
+        tracks (list): A list of dictionaries containing information about the tracks.
+        search_workers (int, optional): The number of concurrent YouTube searches. Defaults to 16.
+        download_workers (int, optional): The number of concurrent downloads. Defaults to 4.
+        encode_workers (int, optional): The number of concurrent FFmpeg encodes. Defaults to the number of CPUs.
+
+    Returns:
+        list: The titles of the tracks that failed to download.
+    """
+    failed_tracks = []
+
+    with ThreadPoolExecutor(max_workers=search_workers) as search_pool, \
+         ThreadPoolExecutor(max_workers=download_workers) as download_pool, \
+         ThreadPoolExecutor(max_workers=encode_workers) as encode_pool:
+        # Maps every running future to its pipeline stage and track, so each result is handed on as soon as it is ready
+        pending = {search_pool.submit(search_youtube_single_track, track): ('search', track) for track in tracks}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, track = pending.pop(future)
+
+                if stage == 'search':
+                    try:
+                        entry, title = future.result()
+                    except Exception as e:
+                        print(f"Error searching {track['full_title']}: {e}")
+                        failed_tracks.append(track['full_title'])
+                        continue
+
+                    if entry is None:
+                        failed_tracks.append(title)
+                        forget_youtube_search(track['search_query'])
+                        continue
+
+                    pending[download_pool.submit(download_track, entry, title)] = ('download', track)
+
+                elif stage == 'download':
+                    path = future.result()
+                    if path is None:
+                        failed_tracks.append(track['full_title'])
+                        forget_youtube_search(track['search_query'])
+                        continue
+
+                    pending[encode_pool.submit(encode_to_mp3, path)] = ('encode', track)
+
+                elif not future.result():
+                    failed_tracks.append(track['full_title'])
+
+    return failed_tracks
 
 
 if __name__ == '__main__':
@@ -199,17 +382,13 @@ if __name__ == '__main__':
     client_id = os.getenv('SPOTIFY_CLIENT_ID')
     client_secret = os.getenv('SPOTIFY_CLIENT_SECRET')
     
-    sp = Spotify(auth_manager=utils.authenticate(client_id, client_secret))
-    liked_songs = sp.current_user_saved_tracks()
+    sp = Spotify(auth_manager=utils.authenticate(client_id, client_secret), requests_session=utils.create_session())
+    liked_songs = get_liked_songs(sp)
     print(f"Detected {liked_songs['total']} liked songs from Spotify.")
     
     tracks = get_info_tracks(liked_songs)
 
-    manager = Manager()
-    failed_tracks = manager.list()
-
-    with Pool() as pool:
-        pool.starmap(download_track, [(track, failed_tracks) for track in tracks])
+    failed_tracks = download_tracks(tracks)
 
     if failed_tracks:
         print("The following tracks failed to download:")
@@ -0,0 +1,33 @@
+import unittest
+from unittest import mock
+
+import mp3ify
+
+
+class SearchYoutubeSingleTrackTest(unittest.TestCase):
+    def setUp(self):
+        item = {'track': {'artists': [{'name': 'Drake'}, {'name': 'Rihanna'}],
+                          'name': 'Take Care',
+                          'duration_ms': 277000}}
+        self.track_info = mp3ify.get_info_single_track(item)
+
+    def search(self, results):
+        with mock.patch.object(mp3ify, 'search_youtube', return_value=results):
+            match, _ = mp3ify.search_youtube_single_track(self.track_info)
+        return match
+
+    def test_exact_duration_topic_upload_beats_longer_lyric_video(self):
+        topic = {'title': 'Take Care', 'channel': 'Drake - Topic', 'duration': 277, 'webpage_url': 'topic'}
+        lyrics = {'title': 'Drake ft. Rihanna - Take Care (Lyrics)', 'channel': 'Lyrics Hub', 'duration': 283, 'webpage_url': 'lyrics'}
+
+        self.assertIs(self.search([lyrics, topic]), topic)
+        self.assertIs(self.search([topic, lyrics]), topic)
+
+    def test_exact_duration_does_not_accept_unrelated_title(self):
+        unrelated = {'title': 'Totally unrelated - Other song', 'channel': 'Someone', 'duration': 277, 'webpage_url': 'unrelated'}
+
+        self.assertIsNone(self.search([unrelated]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,26 +1,55 @@
 import os
+import re
+import json
+import hashlib
+import functools
+import threading
 from datetime import date
-import difflib
 
+from rapidfuzz import fuzz
+from rapidfuzz.utils import default_process
+from requests import Session
+from requests.adapters import HTTPAdapter, Retry
 from spotipy.oauth2 import SpotifyOAuth
 
-def similarity_ratio(s1: str, s2: str) -> float:
+FEAT_RE = re.compile(r'[\(\s](?:feat\.|ft\.)\s*', re.IGNORECASE)  # Matches " feat.", " ft.", "(feat." and "(ft."
+ARTIST_SEPARATOR_RE = re.compile(r',\s*|&\s*')
+
+def normalize(text: str) -> str:
+    """
+    Normalizes a string for similarity matching by lowercasing it and replacing punctuation with spaces.
+
+    Args:
+        text (str): The string to normalize.
+
+    Returns:
+        str: The normalized string.
+    """
+    return default_process(text)
+
+def similarity_ratio(s1: str, s2: str, normalized: bool = False, score_cutoff: float = 0) -> float:
     """
-    Calculates the similarity ratio between two strings.
+    Calculates the similarity ratio between two strings by comparing their sets of words. Case and punctuation
+    are ignored, so neither the word order nor separators like ", " affect the result.
 
     Args:
         s1 (str): The first string.
         s2 (str): The second string.
+        normalized (bool): Whether both strings are already normalized with normalize(). Defaults to False.
+        score_cutoff (float): The minimum ratio of interest. Lower ratios are not fully computed and reported as 0. Defaults to 0.
 
     Returns:
         float: The similarity ratio between the two strings.
     """
-    return difflib.SequenceMatcher(None, s1.lower(), s2.lower()).ratio()
+    processor = None if normalized else default_process
+    return fuzz.token_set_ratio(s1, s2, processor=processor, score_cutoff=score_cutoff * 100) / 100
 
 
+@functools.lru_cache(maxsize=1)
 def format_download_dir() -> str:
     """
     Formats the download directory path based on the current user and date.
+    The path is computed once, so a run that goes past midnight keeps saving to the same directory.
 
     Returns:
         str: The formatted download directory path.
@@ -29,6 +58,69 @@ def format_download_dir() -> str:
     today = date.today().strftime("%d-%m")
     return os.path.join(home, "Downloads", f"mp3ify_{today}")
 
+def format_cache_path(key: str) -> str:
+    """
+    Formats the path of the cache file for the given key inside the user's cache directory.
+
+    Args:
+        key (str): The key identifying the cached value.
+
+    Returns:
+        str: The path of the JSON file holding the cached value.
+    """
+    home = os.path.expanduser("~")
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+    return os.path.join(home, ".cache", "mp3ify", "search", f"{digest}.json")
+
+def load_cached_search(key: str):
+    """
+    Loads previously stored search results from the on-disk cache.
+
+    Args:
+        key (str): The search string the results were stored under.
+
+    Returns:
+        list: The cached search results, or None if nothing usable is cached for the key.
+    """
+    try:
+        with open(format_cache_path(key), encoding="utf-8") as f:
+            return json.load(f) or None  # An empty result is never a usable hit
+    except (OSError, ValueError):
+        return None
+
+def store_cached_search(key: str, results: list) -> None:
+    """
+    Stores search results in the on-disk cache. The file is written to a temporary path first
+    so that concurrent workers never read a partially written entry.
+
+    Args:
+        key (str): The search string to store the results under.
+        results (list): The JSON-serializable search results.
+    """
+    path = format_cache_path(key)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(results, f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Could not cache search results: {e}")
+
+def remove_cached_search(key: str) -> None:
+    """
+    Removes stored search results from the on-disk cache, so that the next lookup searches again.
+
+    Args:
+        key (str): The search string the results were stored under.
+    """
+    try:
+        os.remove(format_cache_path(key))
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        print(f"Could not remove cached search results: {e}")
+
 def authenticate(client_id: str, client_secret: str, redirect_uri: str = 'http://localhost:6060') -> SpotifyOAuth:
     """
     Authenticates the client with the Spotify API using the provided client ID, client secret, and redirect URI.
@@ -46,6 +138,45 @@ def authenticate(client_id: str, client_secret: str, redirect_uri: str = 'http:/
                         scope='user-library-read'
                         )
 
+def split_featured_artists(text: str):
+    """
+    Splits a song title or artist string at the first featuring marker (e.g. "feat." or "(ft.").
+
+    Args:
+        text (str): The text to split.
+
+    Returns:
+        tuple: A tuple containing the text before the marker and the list of featured artists after it.
+    """
+    parts = FEAT_RE.split(text, maxsplit=1)
+    if len(parts) == 1:
+        return text, []
+
+    main, featured_artists = parts
+    return main, [artist.replace(")", "").strip() for artist in ARTIST_SEPARATOR_RE.split(featured_artists)]
+
+def create_session(pool_size: int = 32) -> Session:
+    """
+    Creates an HTTP session that keeps up to pool_size connections per host open for reuse.
+    Failed requests are retried like spotipy does for its own sessions, honoring Retry-After on HTTP 429.
+
+    Args:
+        pool_size (int): The maximum number of connections kept open per host. Defaults to 32.
+
+    Returns:
+        Session: The configured requests session.
+    """
+    retry = Retry(total=3, connect=None, read=False,
+                  allowed_methods=frozenset(['GET', 'POST', 'PUT', 'DELETE']),
+                  status=3, backoff_factor=0.3,
+                  status_forcelist=(429, 500, 502, 503, 504)
+                  )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
 def process_spotify_song_name(song_artists: list, song_title: str):
     """
     Process the Spotify song name by extracting featured artists and updating the song artists list.
@@ -57,17 +188,7 @@ def process_spotify_song_name(song_artists: list, song_title: str):
     Returns:
         tuple: A tuple containing the updated song artists list and the processed song title.
     """
-    artists = []
-    feat_strings = [" feat.", " ft.", "(feat.", "(ft."]
-
-    for feat_string in feat_strings:
-        if feat_string in song_title:
-            title, featured_artists = song_title.split(feat_string)
-            featured_artists = [artist.replace(")", "").strip() for artist in featured_artists.split(", " if ", " in featured_artists else "& ")]
-            artists.extend(featured_artists)
-
-    if not artists:
-        title = song_title
+    title, artists = split_featured_artists(song_title)
 
     for artist in artists:
         if artist not in song_artists:
@@ -75,41 +196,31 @@ def process_spotify_song_name(song_artists: list, song_title: str):
     
     return song_artists, title.strip()
 
-def process_yt_title(yt_title: str):
+def process_yt_title(yt_title: str, channel: str = None):
     """
     Process the YouTube video title by extracting featured artists and the song title.
 
     Args:
         yt_title (str): Title of the YouTube video.
+        channel (str): Name of the channel that uploaded the video. Used as the artist when the title
+            has no ' - ', like the "Artist - Topic" channels of auto-generated uploads. Defaults to None.
 
     Returns:
         tuple: A tuple containing the extracted artists and the processed song title.
     """
-    left_artists, right_artists = [], []
-    title = None
     try:
         left_side, right_side = yt_title.split(" - ", maxsplit=1)
     except ValueError:  # Handle cases where there is no ' - ' in the title
-        left_side, right_side = yt_title, ""
-
-    feat_strings = [" feat.", " ft.", "(feat.", "(ft."]
-    for feat_string in feat_strings:
-        if feat_string in left_side:
-            main_artist, featured_artists = left_side.split(feat_string)
-            featured_artists = [artist.replace(")", "").strip() for artist in featured_artists.split(", " if ", " in featured_artists else "& ")]
-            left_artists.extend([main_artist.strip()] + featured_artists)
-
-        if feat_string in right_side:
-            title, featured_artists = right_side.split(feat_string)
-            featured_artists = [artist.replace(")", "").strip() for artist in featured_artists.split(", " if ", " in featured_artists else "& ")]
-            right_artists.extend(featured_artists)
-
-    if not left_artists:
-        left_artists.append(left_side.strip())
+        if channel:
+            if channel.endswith(" - Topic"):
+                channel = channel[:-len(" - Topic")]
+            left_side, right_side = channel, yt_title
+        else:
+            left_side, right_side = yt_title, ""
 
-    if not title:
-        title = right_side.strip()
+    main_artist, left_artists = split_featured_artists(left_side)
+    title, right_artists = split_featured_artists(right_side)
 
-    artists = left_artists + right_artists
+    artists = [main_artist.strip()] + left_artists + right_artists
 
-    return artists, title
+    return artists, title.strip()